@@ -30,7 +30,7 @@ class BpeTokenizer(private val basePath: String, private val ortEnv: OrtEnvironm
 
     // GPT2 regex
     private val pattern: Pattern = Pattern.compile(
-        "''s|'t|'re|'ve|'m|'ll|'d| ?\\p{L}+| ?\\p{N}+| ?[^\\s\\p{L}\\p{N}]+|\\s+(?!\\S)|\\s+"
+        "'s|'t|'re|'ve|'m|'ll|'d| ?\\p{L}+| ?\\p{N}+| ?[^\\s\\p{L}\\p{N}]+|\\s+(?!\\S)|\\s+"
     )
 
     private val byteEncoder: Map<Int, String> = buildBytesToUnicode()
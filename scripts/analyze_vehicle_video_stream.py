@@ -10,6 +10,51 @@ import json
 import os
 import sys
 import re
+import io
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+# adb shell批量执行时的命令输出分隔符，后跟该命令的退出码
+ADB_SEP = '___SEP___'
+
+# dumpsys media.camera 中的摄像头编号
+_CAMERA_ID_RE = re.compile(r'Camera (\d+)')
+
+# 设备枚举类ADB结果的短时缓存: 命令参数元组 → (时间戳, CompletedProcess)
+_ADB_CACHE_TTL = 5.0
+_adb_cache = {}
+_adb_cache_lock = threading.Lock()
+
+
+def run_adb_cached(args):
+    """执行adb命令，TTL内相同参数的重复调用直接返回缓存结果"""
+    key = tuple(args)
+    now = time.monotonic()
+    with _adb_cache_lock:
+        cached = _adb_cache.get(key)
+        if cached is not None and now - cached[0] < _ADB_CACHE_TTL:
+            return cached[1]
+    result = subprocess.run(list(args), capture_output=True, text=True)
+    with _adb_cache_lock:
+        _adb_cache[key] = (time.monotonic(), result)
+    return result
+
+
+class _ThreadLocalStdout:
+    """按线程重定向print输出，并发探测时各分析段落的输出互不穿插"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, s):
+        return getattr(self.local, 'buffer', self.stream).write(s)
+
+    def flush(self):
+        getattr(self.local, 'buffer', self.stream).flush()
+
 
 class VehicleVideoStreamAnalyzer:
     def __init__(self):
@@ -24,7 +69,7 @@ class VehicleVideoStreamAnalyzer:
     def check_adb_connection(self):
         """检查ADB连接状态"""
         try:
-            result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
+            result = run_adb_cached(['adb', 'devices'])
             if 'device' in result.stdout and 'List of devices' in result.stdout:
                 print("✅ ADB连接正常")
                 return True
@@ -35,6 +80,55 @@ class VehicleVideoStreamAnalyzer:
             print("❌ ADB工具未找到，请安装Android SDK")
             return False
 
+    def adb_shell_batch(self, cmds):
+        """在单个adb shell会话中依次执行多条命令，结果经TTL缓存，用于会话内基本不变的探测（如HAL库列表）
+
+        返回与cmds一一对应的 (returncode, stdout) 列表；需要边接收边解析时使用 stream_adb_shell
+        """
+        result = run_adb_cached(['adb', 'shell', self._batch_script(cmds)])
+        return list(self._split_batch_lines(result.stdout.splitlines(True), len(cmds), result.returncode))
+
+    def stream_adb_shell(self, cmds):
+        """流式执行批量命令，每条命令的输出一结束就产出 (returncode, stdout)"""
+        proc = subprocess.Popen(['adb', 'shell', self._batch_script(cmds)],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        try:
+            yield from self._split_batch_lines(proc.stdout, len(cmds), None, proc)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+    @staticmethod
+    def _batch_script(cmds):
+        return ' ; '.join(f'{cmd} ; echo {ADB_SEP}$?' for cmd in cmds)
+
+    @staticmethod
+    def _split_batch_lines(lines, count, returncode, proc=None):
+        """按 ADB_SEP<退出码> 行拆分批量命令输出"""
+        done = 0
+        chunk = []
+        for line in lines:
+            idx = line.find(ADB_SEP)
+            if idx < 0:
+                chunk.append(line)
+                continue
+            chunk.append(line[:idx])
+            try:
+                rc = int(line[idx + len(ADB_SEP):].strip())
+            except ValueError:
+                rc = 1
+            yield rc, ''.join(chunk)
+            chunk = []
+            done += 1
+            if done == count:
+                return
+        # 会话中途断开，剩余命令视为失败
+        if proc is not None:
+            returncode = proc.wait()
+        for _ in range(count - done):
+            yield returncode or 1, ''.join(chunk)
+            chunk = []
+
     def analyze_linux_video_devices(self):
         """分析Linux层视频设备"""
         if not self.adb_available:
@@ -42,37 +136,33 @@ class VehicleVideoStreamAnalyzer:
         
         print("\n🔍 分析Linux层视频设备...")
         
-        # 检查/dev/video*设备
         try:
-            result = subprocess.run([
-                'adb', 'shell', 'ls -la /dev/video*'
-            ], capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                video_devices = result.stdout.strip().split('\n')
-                for device in video_devices:
-                    if '/dev/video' in device:
-                        self.results['linux_video_devices'].append({
-                            'device': device.split()[-1],
-                            'permissions': device.split()[0],
-                            'details': device
-                        })
-                        print(f"  📹 发现视频设备: {device.split()[-1]}")
-        except Exception as e:
-            print(f"  ⚠️ 检查Linux视频设备失败: {e}")
+            with closing(self.stream_adb_shell([
+                'ls -la /dev/video*',
+                'find /dev -name "*cam*" -o -name "*video*" 2>/dev/null'
+            ])) as outputs:
+                # 检查/dev/video*设备（find 仍在执行时即可解析）
+                video_rc, video_out = next(outputs)
+                if video_rc == 0:
+                    video_devices = video_out.strip().split('\n')
+                    for device in video_devices:
+                        if '/dev/video' in device:
+                            self.results['linux_video_devices'].append({
+                                'device': device.split()[-1],
+                                'permissions': device.split()[0],
+                                'details': device.strip()
+                            })
+                            print(f"  📹 发现视频设备: {device.split()[-1]}")
 
-        # 检查camera相关设备
-        try:
-            result = subprocess.run([
-                'adb', 'shell', 'find /dev -name "*cam*" -o -name "*video*" 2>/dev/null'
-            ], capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                for device in result.stdout.strip().split('\n'):
-                    if device and '/dev/' in device:
-                        print(f"  📷 相关设备: {device}")
+                # 检查camera相关设备
+                cam_rc, cam_out = next(outputs)
+                if cam_rc == 0:
+                    for device in cam_out.strip().split('\n'):
+                        device = device.strip()
+                        if device and '/dev/' in device:
+                            print(f"  📷 相关设备: {device}")
         except Exception as e:
-            print(f"  ⚠️ 检查相关设备失败: {e}")
+            print(f"  ⚠️ 检查Linux视频设备失败: {e}")
 
     def analyze_android_camera_interface(self):
         """分析Android Camera API接口"""
@@ -101,14 +191,19 @@ class VehicleVideoStreamAnalyzer:
         
         # 使用dumpsys检查camera服务
         try:
-            result = subprocess.run([
+            # dumpsys输出很大，边接收边逐行解析，不等待整个输出缓冲完
+            proc = subprocess.Popen([
                 'adb', 'shell', 'dumpsys media.camera'
-            ], capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                camera_info = result.stdout
-                # 解析摄像头信息
-                camera_ids = re.findall(r'Camera (\d+)', camera_info)
+            ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+
+            camera_ids = []
+            with proc:
+                for line in proc.stdout:
+                    # 解析摄像头信息
+                    camera_ids.extend(_CAMERA_ID_RE.findall(line))
+
+            # 命令失败时输出不可信，丢弃解析结果
+            if proc.returncode == 0:
                 for camera_id in camera_ids:
                     self.results['android_camera_devices'].append({
                         'camera_id': camera_id,
@@ -134,19 +229,6 @@ class VehicleVideoStreamAnalyzer:
             'ro.hardware.camera.atr'
         ]
         
-        for prop in atr_properties:
-            try:
-                result = subprocess.run([
-                    'adb', 'shell', f'getprop {prop}'
-                ], capture_output=True, text=True)
-                
-                value = result.stdout.strip()
-                if value:
-                    print(f"  🎯 ATR属性 {prop}: {value}")
-                    
-            except Exception as e:
-                print(f"  ⚠️ 检查属性 {prop} 失败: {e}")
-
         # 检查可能的ATR设备节点
         atr_paths = [
             '/dev/atr',
@@ -154,19 +236,23 @@ class VehicleVideoStreamAnalyzer:
             '/dev/atr_camera',
             '/sys/class/video4linux/*/name'
         ]
-        
-        for path in atr_paths:
-            try:
-                result = subprocess.run([
-                    'adb', 'shell', f'ls -la {path} 2>/dev/null'
-                ], capture_output=True, text=True)
-                
-                if result.returncode == 0 and result.stdout.strip():
-                    print(f"  📡 ATR设备路径: {path}")
-                    print(f"     详情: {result.stdout.strip()}")
-                    
-            except Exception as e:
-                continue
+
+        cmds = [f'getprop {prop}' for prop in atr_properties]
+        cmds += [f'ls -la {path} 2>/dev/null' for path in atr_paths]
+        try:
+            # 每条命令的输出一到达就解析；zip 先取 props/paths，不会多消费 outputs
+            with closing(self.stream_adb_shell(cmds)) as outputs:
+                for prop, (_, stdout) in zip(atr_properties, outputs):
+                    value = stdout.strip()
+                    if value:
+                        print(f"  🎯 ATR属性 {prop}: {value}")
+
+                for path, (returncode, stdout) in zip(atr_paths, outputs):
+                    if returncode == 0 and stdout.strip():
+                        print(f"  📡 ATR设备路径: {path}")
+                        print(f"     详情: {stdout.strip()}")
+        except Exception as e:
+            print(f"  ⚠️ 检查ATR接口失败: {e}")
 
     def check_hal_camera_interface(self):
         """检查HAL Camera接口"""
@@ -181,20 +267,19 @@ class VehicleVideoStreamAnalyzer:
             '/vendor/lib/hw/camera*',
             '/system/lib64/hw/camera*'
         ]
-        
-        for path in hal_paths:
-            try:
-                result = subprocess.run([
-                    'adb', 'shell', f'ls {path} 2>/dev/null'
-                ], capture_output=True, text=True)
-                
-                if result.returncode == 0:
-                    for lib in result.stdout.strip().split('\n'):
-                        if lib and 'camera' in lib:
-                            print(f"  🔧 HAL库: {lib}")
-                            
-            except Exception as e:
-                continue
+
+        try:
+            outputs = self.adb_shell_batch([f'ls {path} 2>/dev/null' for path in hal_paths])
+        except Exception as e:
+            print(f"  ⚠️ 检查HAL库失败: {e}")
+            return
+
+        for returncode, stdout in outputs:
+            if returncode == 0:
+                for lib in stdout.strip().split('\n'):
+                    lib = lib.strip()
+                    if lib and 'camera' in lib:
+                        print(f"  🔧 HAL库: {lib}")
 
     def generate_recommendations(self):
         """生成视频流接入建议"""
@@ -292,15 +377,42 @@ echo "=== 分析完成 ==="
             json.dump(self.results, f, ensure_ascii=False, indent=2)
         print("📊 分析结果已保存到 vehicle_video_analysis.json")
 
+    def _run_buffered(self, proxy, probe):
+        """在工作线程中执行探测，返回其打印输出"""
+        proxy.local.buffer = io.StringIO()
+        try:
+            probe()
+            return proxy.local.buffer.getvalue()
+        finally:
+            del proxy.local.buffer
+
+    def run_probes(self):
+        """并发执行相互独立的ADB探测，按固定顺序输出结果"""
+        probes = [
+            self.analyze_linux_video_devices,
+            self.analyze_android_camera_interface,
+            self.analyze_atr_interface,
+            self.check_hal_camera_interface
+        ]
+
+        stdout = sys.stdout
+        proxy = _ThreadLocalStdout(stdout)
+        sys.stdout = proxy
+        try:
+            with ThreadPoolExecutor(max_workers=len(probes)) as pool:
+                # map按提交顺序返回，先完成的探测不会打乱输出顺序
+                for output in pool.map(lambda probe: self._run_buffered(proxy, probe), probes):
+                    stdout.write(output)
+                    stdout.flush()
+        finally:
+            sys.stdout = stdout
+
     def run_analysis(self):
         """执行完整分析"""
         print("🚗 开始分析8295车机ATR视频流架构")
         print("=" * 50)
         
-        self.analyze_linux_video_devices()
-        self.analyze_android_camera_interface()
-        self.analyze_atr_interface()
-        self.check_hal_camera_interface()
+        self.run_probes()
         self.generate_recommendations()
         self.generate_implementation_script()
         self.save_results()
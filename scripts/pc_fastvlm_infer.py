@@ -1,8 +1,10 @@
 import os
 import sys
+import copy
 import json
 import time
 import math
+import heapq
 import argparse
 import numpy as np
 from PIL import Image
@@ -11,6 +13,14 @@ try:
     import regex as re  # 支持 \p{L} 等Unicode属性
 except Exception:
     import re
+try:
+    from tokenizers import Tokenizer, Regex, models, pre_tokenizers  # 可选: Rust BPE后端
+except Exception:
+    Tokenizer = None
+try:
+    import cv2  # 可选: OpenCV SIMD resize
+except Exception:
+    cv2 = None
 
 # PC端FastVLM ONNX推理脚本（CPU默认）
 # - 读取 FastVLM-onnx/config.json, tokenizer, projector权重
@@ -34,6 +44,14 @@ VPROJ_L1_W = os.path.join(BASE_DIR, 'vision_projector_l1_w.bin')
 VPROJ_L1_B = os.path.join(BASE_DIR, 'vision_projector_l1_b.bin')
 VPROJ_L2_W = os.path.join(BASE_DIR, 'vision_projector_l2_w.bin')
 VPROJ_L2_B = os.path.join(BASE_DIR, 'vision_projector_l2_b.bin')
+VPROJ_INT8_ONNX = os.path.join(BASE_DIR, 'vision_projector_int8.onnx')
+
+# GPT2切分正则（与车机端 BpeTokenizer.kt 保持一致）
+BPE_SPLIT_PATTERN = r"'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"
+try:
+    _BPE_SPLIT_RE = re.compile(BPE_SPLIT_PATTERN)
+except re.error:
+    _BPE_SPLIT_RE = re.compile(r"\S+|\s+")  # 标准库re不支持 \p{L}，退化为按空白切分
 
 
 class BpeTokenizerPy:
@@ -49,10 +67,21 @@ class BpeTokenizerPy:
         self.eos_id = None
         self.pad_id = None
         self.image_id = None
-        self.pattern = re.compile(r"''s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+") if hasattr(re, 'compile') else re.compile(r"\S+|\s+")
+        self.pattern = _BPE_SPLIT_RE
         self.byte_encoder = self._build_bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
+        # str.translate 查表：latin1解码后的字节字符 ↔ byte-level unicode字符
+        self._byte_enc_table = dict(self.byte_encoder)
+        self._byte_dec_table = {ord(ch): b for ch, b in self.byte_decoder.items()}
+        # U+0100以下但不在映射中的字符会被latin1原样编码，显式映射为None丢弃；更高的码位由 errors='ignore' 丢弃
+        self._byte_dec_table.update({cp: None for cp in range(256) if cp not in self._byte_dec_table})
+        self._fast = None
+        self._special_re = None
         self._load_files()
+        # 所有特殊token合成一个交替正则，长的优先，一次扫描即可切分
+        specials = sorted((tok for tok in self.special_to_id if tok), key=len, reverse=True)
+        if specials:
+            self._special_re = re.compile('|'.join(re.escape(tok) for tok in specials))
 
     def _resolve_dir(self):
         direct = self.base_dir
@@ -105,6 +134,22 @@ class BpeTokenizerPy:
                 content = sm['pad_token'].get('content', '')
                 if content in self.special_to_id:
                     self.pad_id = self.special_to_id[content]
+        self._fast = self._build_fast_tokenizer()
+
+    def _build_fast_tokenizer(self):
+        # 安装了 tokenizers 时用已解析的 vocab/bpe_ranks 与同一切分正则构建Rust后端，
+        # merges 与纯Python路径（及车机端）一样跳过以 # 开头的行，编码结果一致
+        if Tokenizer is None:
+            return None
+        try:
+            fast = Tokenizer(models.BPE(vocab=self.vocab, merges=list(self.bpe_ranks)))
+            fast.pre_tokenizer = pre_tokenizers.Sequence([
+                pre_tokenizers.Split(Regex(BPE_SPLIT_PATTERN), behavior='isolated'),
+                pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False),
+            ])
+            return fast
+        except Exception:
+            return None
 
     def _build_bytes_to_unicode(self):
         bs = list(range(33, 127)) + list(range(161, 173)) + list(range(174, 256))
@@ -117,53 +162,45 @@ class BpeTokenizerPy:
                 n += 1
         return {b: chr(c) for b, c in zip(bs, cs)}
 
-    def _get_pairs(self, word):
-        pairs = set()
-        prev = None
-        for ch in word:
-            if prev is not None:
-                pairs.add((prev, ch))
-            prev = ch
-        return pairs
-
     def _bpe(self, token: str):
+        # 堆式BPE：符号用双向链表串起来，相邻对按 (rank, 位置) 入堆，每次弹出最小rank合并，
+        # 只需为合并点两侧的新相邻对入堆，O(n log n)；同rank按位置从左到右，结果与逐轮扫描一致
         if not token:
             return []
-        word = list(token)
-        pairs = self._get_pairs(word)
-        if not pairs:
+        if len(token) == 1:
             return [token]
-        while True:
-            bigram = min(pairs, key=lambda p: self.bpe_ranks.get(p, 10**9))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                j = i
-                found = False
-                while j < len(word):
-                    if word[j] == first:
-                        found = True
-                        break
-                    j += 1
-                if not found:
-                    new_word.extend(word[i:])
-                    break
-                new_word.extend(word[i:j])
-                i = j
-                if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
-                    new_word.append(first + second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            word = new_word
-            if len(word) == 1:
-                break
-            pairs = self._get_pairs(word)
-        return word
+        ranks = self.bpe_ranks
+        syms = list(token)
+        n = len(syms)
+        nxt = list(range(1, n)) + [-1]
+        prv = list(range(-1, n - 1))
+        heap = []
+        for i in range(n - 1):
+            r = ranks.get((syms[i], syms[i + 1]))
+            if r is not None:
+                heap.append((r, i))
+        heapq.heapify(heap)
+        while heap:
+            r, i = heapq.heappop(heap)
+            j = nxt[i]
+            # 过期项：左符号已被并入前一个符号，或该位置的相邻对已变化
+            if syms[i] is None or j < 0 or ranks.get((syms[i], syms[j])) != r:
+                continue
+            syms[i] = syms[i] + syms[j]
+            syms[j] = None
+            k = nxt[j]
+            nxt[i] = k
+            if k >= 0:
+                prv[k] = i
+                r = ranks.get((syms[i], syms[k]))
+                if r is not None:
+                    heapq.heappush(heap, (r, i))
+            p = prv[i]
+            if p >= 0:
+                r = ranks.get((syms[p], syms[i]))
+                if r is not None:
+                    heapq.heappush(heap, (r, p))
+        return [sym for sym in syms if sym is not None]
 
     def apply_chat_template(self, user_prompt: str) -> str:
         system = "<|im_start|>system\nYou are a helpful assistant. Please answer in English only.<|im_end|>\n"
@@ -172,58 +209,47 @@ class BpeTokenizerPy:
         return system + user + assistant_head
 
     def tokenize_to_ids(self, text: str):
+        if self._special_re is None:
+            return np.array(self._encode_segment(text), dtype=np.int64)
         ids = []
-        i = 0
-        specials = list(self.special_to_id.keys())
-        while i < len(text):
-            # 找到下一个特殊token
-            next_pos = None
-            next_tok = None
-            for tok in specials:
-                idx = text.find(tok, i)
-                if idx >= 0 and (next_pos is None or idx < next_pos):
-                    next_pos = idx
-                    next_tok = tok
-            if next_pos is None:
-                segment = text[i:]
-                ids.extend(self._encode_segment(segment))
-                break
-            else:
-                if next_pos > i:
-                    ids.extend(self._encode_segment(text[i:next_pos]))
-                ids.append(self.special_to_id[next_tok])
-                i = next_pos + len(next_tok)
+        pos = 0
+        for m in self._special_re.finditer(text):
+            if m.start() > pos:
+                ids.extend(self._encode_segment(text[pos:m.start()]))
+            ids.append(self.special_to_id[m.group(0)])
+            pos = m.end()
+        ids.extend(self._encode_segment(text[pos:]))
         return np.array(ids, dtype=np.int64)
 
     def _encode_segment(self, segment: str):
         if not segment:
             return []
+        if self._fast is not None:
+            return self._fast.encode(segment, add_special_tokens=False).ids
         out = []
         for m in self.pattern.finditer(segment):
             piece = m.group(0)
             # bytes→unicode
-            encoded = ''.join(self.byte_encoder[b] for b in piece.encode('utf-8'))
+            encoded = piece.encode('utf-8').decode('latin1').translate(self._byte_enc_table)
             # bpe
             for tok in self._bpe(encoded):
                 out.append(self.vocab.get(tok, self.vocab.get('<unk>', 0)))
         return out
 
     def decode(self, ids: list) -> str:
-        bytes_list = []
+        toks = []
         for tid in ids:
             if tid in self.id_to_special:
                 continue
             tok = self.id_to_token.get(int(tid))
-            if tok is None:
-                continue
-            for ch in tok:
-                b = self.byte_decoder.get(ch)
-                if b is not None:
-                    bytes_list.append(b)
+            if tok is not None:
+                toks.append(tok)
+        # unicode→bytes，无法映射的字符丢弃
+        data = ''.join(toks).translate(self._byte_dec_table).encode('latin1', errors='ignore')
         try:
-            return bytes(bytearray(bytes_list)).decode('utf-8').strip()
+            return data.decode('utf-8').strip()
         except Exception:
-            return bytes(bytearray(bytes_list)).decode(errors='ignore').strip()
+            return data.decode(errors='ignore').strip()
 
 
 def load_json(path):
@@ -231,76 +257,264 @@ def load_json(path):
         return json.load(f)
 
 
-def preprocess_image(path):
+def _load_resized_rgb(path, size):
+    # 优先用 OpenCV 读图+resize（SIMD内核）；忽略EXIF方向以与PIL读取结果一致
+    if cv2 is not None:
+        bgr = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if bgr is not None:
+            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+            # INTER_CUBIC 缩小时不抗锯齿，与PIL BICUBIC差异明显；缩小改用 INTER_AREA
+            h, w = rgb.shape[:2]
+            shrink = w > size[0] or h > size[1]
+            return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA if shrink else cv2.INTER_CUBIC)
     img = Image.open(path).convert('RGB')
-    # 统一 Resize 到 1024x1024（与移动端一致），不裁剪
-    img = img.resize((1024, 1024), Image.BICUBIC)
-    arr = np.asarray(img, dtype=np.float32) / 255.0
-    # HWC → CHW
-    chw = np.transpose(arr, (2, 0, 1))
-    # batch=1
-    return chw.reshape(1, 3, 1024, 1024)
+    return np.asarray(img.resize(size, Image.BICUBIC))
 
 
-def gelu(x):
-    return 0.5 * x * (1.0 + np.tanh(np.sqrt(2.0 / np.pi) * (x + 0.044715 * np.power(x, 3))))
+def preprocess_image(path):
+    # 统一 Resize 到 1024x1024（与移动端一致），不裁剪
+    rgb = _load_resized_rgb(path, (1024, 1024))  # [H, W, 3] uint8
+    # HWC → CHW 与 /255 归一化合并为按通道一次写入，输出直接是连续的 [1, 3, H, W]
+    out = np.empty((1, 3, rgb.shape[0], rgb.shape[1]), dtype=np.float32)
+    scale = np.float32(1.0 / 255.0)
+    for c in range(3):
+        np.multiply(rgb[:, :, c], scale, out=out[0, c])
+    return out
 
 
-def load_bin_f32(path):
-    with open(path, 'rb') as f:
-        data = np.frombuffer(f.read(), dtype=np.float32)
-    return data
+_GELU_K = np.float32(math.sqrt(2.0 / math.pi))
 
 
-def project_vision(x_2d, hidden_expected, mm_hidden_expected):
+def gelu(x):
+    # tanh近似: 0.5 * x * (1 + tanh(k * (x + 0.044715 * x^3)))，原地运算只分配一个输出
+    y = x * x
+    y *= x
+    y *= np.float32(0.044715)
+    y += x
+    y *= _GELU_K
+    np.tanh(y, out=y)
+    y += np.float32(1.0)
+    y *= x
+    y *= np.float32(0.5)
+    return y
+
+
+def load_bin_f32(path, shape=None):
+    # 只读映射文件，不经过 bytes 中转拷贝，按需由页缓存加载
+    return np.memmap(path, dtype=np.float32, mode='r', shape=shape)
+
+
+# projector权重（懒加载，进程内只读一次）：(l1_w.T, l1_b, l2_w.T, l2_b)
+_PROJ = None
+
+
+def _get_proj():
+    global _PROJ
+    if _PROJ is None:
+        l1_b = load_bin_f32(VPROJ_L1_B)
+        # 从权重推断维度
+        hidden = l1_b.size
+        mm_hidden = os.path.getsize(VPROJ_L1_W) // 4 // hidden
+        l1_w = load_bin_f32(VPROJ_L1_W, (hidden, mm_hidden))
+        l2_w = load_bin_f32(VPROJ_L2_W, (hidden, hidden))
+        l2_b = load_bin_f32(VPROJ_L2_B, (hidden,))
+        # .T 是连续数组的转置视图，np.dot 直接以转置标志交给BLAS，不会拷贝映射的权重
+        _PROJ = (l1_w.T, l1_b, l2_w.T, l2_b)
+    return _PROJ
+
+
+def build_projector_int8(out_path=VPROJ_INT8_ONNX):
+    # 把 projector (MatMul+GELU+MatMul) 导出为ONNX并做int8动态量化，走ORT的QGEMM内核
+    # 结果缓存到 out_path；缺少 onnx 包或导出/量化失败时打印警告并返回 None，回退到numpy FP32
+    srcs = [VPROJ_L1_W, VPROJ_L1_B, VPROJ_L2_W, VPROJ_L2_B]
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= max(os.path.getmtime(p) for p in srcs):
+        return out_path
+    try:
+        import onnx
+        from onnx import helper, numpy_helper, TensorProto
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        print('警告：未安装 onnx，无法生成int8 projector，回退到numpy FP32')
+        return None
+    fp32_path = os.path.splitext(out_path)[0] + '_fp32.onnx'
+    try:
+        l1_wT, l1_b, l2_wT, l2_b = _get_proj()
+        mm_hidden, hidden = l1_wT.shape
+
+        def const(name, value):
+            return numpy_helper.from_array(np.asarray(value, dtype=np.float32), name)
+
+        inits = [
+            const('l1_wT', l1_wT), const('l1_b', l1_b), const('l2_wT', l2_wT), const('l2_b', l2_b),
+            const('c_cubic', 0.044715), const('c_k', _GELU_K), const('c_one', 1.0), const('c_half', 0.5),
+        ]
+        nodes = [
+            helper.make_node('MatMul', ['x', 'l1_wT'], ['h0']),
+            helper.make_node('Add', ['h0', 'l1_b'], ['h1']),
+            # GELU tanh近似，与 gelu() 相同
+            helper.make_node('Mul', ['h1', 'h1'], ['g0']),
+            helper.make_node('Mul', ['g0', 'h1'], ['g1']),
+            helper.make_node('Mul', ['g1', 'c_cubic'], ['g2']),
+            helper.make_node('Add', ['g2', 'h1'], ['g3']),
+            helper.make_node('Mul', ['g3', 'c_k'], ['g4']),
+            helper.make_node('Tanh', ['g4'], ['g5']),
+            helper.make_node('Add', ['g5', 'c_one'], ['g6']),
+            helper.make_node('Mul', ['g6', 'h1'], ['g7']),
+            helper.make_node('Mul', ['g7', 'c_half'], ['h2']),
+            helper.make_node('MatMul', ['h2', 'l2_wT'], ['y0']),
+            helper.make_node('Add', ['y0', 'l2_b'], ['y']),
+        ]
+        graph = helper.make_graph(
+            nodes, 'vision_projector',
+            [helper.make_tensor_value_info('x', TensorProto.FLOAT, ['T', mm_hidden])],
+            [helper.make_tensor_value_info('y', TensorProto.FLOAT, ['T', hidden])],
+            initializer=inits,
+        )
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+        model.ir_version = 8  # 兼容较旧的 onnxruntime
+        onnx.save(model, fp32_path)
+        quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+        return out_path
+    except Exception as e:
+        print(f'警告：int8 projector导出/量化失败（{e}），回退到numpy FP32')
+        return None
+    finally:
+        if os.path.exists(fp32_path):
+            os.remove(fp32_path)
+
+
+def project_vision(x_2d, hidden_expected, mm_hidden_expected, proj_sess=None):
     # x_2d: [T, feat_dim]; projector权重决定输入/输出维度
-    l1_w_raw = load_bin_f32(VPROJ_L1_W)
-    l1_b_raw = load_bin_f32(VPROJ_L1_B)
-    # 从权重推断维度
-    hidden = l1_b_raw.size
-    mm_hidden = l1_w_raw.size // hidden
-    l1_w = l1_w_raw.reshape(hidden, mm_hidden)
-    l1_b = l1_b_raw.reshape(hidden)
-    l2_w = load_bin_f32(VPROJ_L2_W).reshape(hidden, hidden)
-    l2_b = load_bin_f32(VPROJ_L2_B).reshape(hidden)
+    # proj_sess: build_projector_int8 生成的ORT会话，未提供时用numpy FP32计算
+    l1_wT, l1_b, l2_wT, l2_b = _get_proj()
+    mm_hidden, hidden = l1_wT.shape
 
     # 若输入特征维与权重输入不符，直接报错
     if x_2d.shape[1] != mm_hidden:
         raise ValueError(f"Projector expects mm_hidden={mm_hidden}, but got feat_dim={x_2d.shape[1]}")
 
-    y = x_2d @ l1_w.T + l1_b
-    y = gelu(y)
-    y = y @ l2_w.T + l2_b
-    return y.astype(np.float32)  # [T, hidden]
-
-
-def top_p_sample(logits, top_p=0.95, temperature=0.7, repetition_penalty=1.1, seen=None):
+    x_2d = np.ascontiguousarray(x_2d, dtype=np.float32)
+    if proj_sess is not None:
+        return proj_sess.run(None, {'x': x_2d})[0]  # [T, hidden]
+    T = x_2d.shape[0]
+    h = np.empty((T, hidden), dtype=np.float32)
+    np.dot(x_2d, l1_wT, out=h)
+    h += l1_b
+    h = gelu(h)
+    y = np.empty((T, hidden), dtype=np.float32)
+    np.dot(h, l2_wT, out=y)
+    y += l2_b
+    return y  # [T, hidden]
+
+
+def top_p_sample(logits, top_p=0.95, temperature=0.7, repetition_penalty=1.1, seen=None, top_k_init=256, ids=None):
+    # ids: logits 各位置对应的token id（解码器图内已做TopK时传入），默认 logits 覆盖整个词表
     if seen is None:
         seen = {}
-    logits = logits.astype(np.float64)
+    pos = None
+    if seen:
+        seen_ids = np.fromiter(seen.keys(), dtype=np.int64, count=len(seen))
+        pos = seen_ids if ids is None else np.nonzero(np.isin(ids, seen_ids))[0].astype(np.int64)
+    logits = np.array(logits, dtype=np.float32)
     # 重复惩罚
-    for tid, cnt in seen.items():
-        if cnt > 0:
-            if logits[tid] > 0:
-                logits[tid] /= repetition_penalty
-            else:
-                logits[tid] *= repetition_penalty
+    if pos is not None:
+        vals = logits[pos]
+        logits[pos] = np.where(vals > 0, vals / repetition_penalty, vals * repetition_penalty)
     # 温度
     t = max(temperature, 1e-6)
-    logits = logits / t
-    # softmax
-    m = np.max(logits)
-    probs = np.exp(logits - m)
+    logits /= np.float32(t)
+    # softmax（原地）
+    logits -= np.max(logits)
+    probs = np.exp(logits, out=logits)
     probs /= np.sum(probs)
-    # top-p裁剪
-    idx = np.argsort(-probs)
-    cumsum = np.cumsum(probs[idx])
+    # top-p裁剪：只对前k个候选排序，累计概率不足top_p时扩大k
+    n = probs.size
+    k = min(top_k_init, n)
+    while True:
+        idx = np.argpartition(-probs, k - 1)[:k] if k < n else np.arange(n)
+        idx = idx[np.argsort(-probs[idx])]
+        cumsum = np.cumsum(probs[idx])
+        if cumsum[-1] >= top_p or k >= n:
+            break
+        k = min(k * 2, n)
     keep_n = np.searchsorted(cumsum, top_p) + 1
     keep_idx = idx[:keep_n]
-    keep_probs = probs[keep_idx]
+    keep_probs = probs[keep_idx].astype(np.float64)  # 候选集很小，归一化用float64满足choice的精度校验
     keep_probs /= keep_probs.sum()
     choice = np.random.choice(keep_idx, p=keep_probs)
-    return int(choice)
+    return int(choice) if ids is None else int(ids[choice])
+
+
+def build_topk_decoder(model_path, k):
+    # 在解码器图末尾追加 Slice(最后一个位置) + TopK(k)，每步只有k个候选从ORT传回Python
+    # 生成的模型缓存在原模型同目录；缺少 onnx 包或改图失败时打印警告并返回 None，回退到完整logits
+    out_path = os.path.splitext(model_path)[0] + f'_top{k}.onnx'
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(model_path):
+        return out_path
+    try:
+        import onnx
+        from onnx import helper, TensorProto
+    except ImportError:
+        print('警告：未安装 onnx，无法在解码器图内追加TopK，回退到完整logits')
+        return None
+    try:
+        # 外部权重按相对路径引用，写回同目录后仍然有效
+        model = onnx.load(model_path, load_external_data=False)
+        opset = max((o.version for o in model.opset_import if o.domain in ('', 'ai.onnx')), default=0)
+        if opset < 10:  # Slice/TopK 以输入形式给出参数需要 opset>=10
+            print(f'警告：解码器 opset={opset} 低于10，无法追加TopK，回退到完整logits')
+            return None
+        graph = model.graph
+        logits = graph.output[0]
+        graph.initializer.extend([
+            helper.make_tensor('topk_slice_starts', TensorProto.INT64, [1], [-1]),
+            helper.make_tensor('topk_slice_ends', TensorProto.INT64, [1], [2 ** 63 - 1]),
+            helper.make_tensor('topk_slice_axes', TensorProto.INT64, [1], [1]),
+            helper.make_tensor('topk_k', TensorProto.INT64, [1], [k]),
+        ])
+        graph.node.extend([
+            helper.make_node('Slice', [logits.name, 'topk_slice_starts', 'topk_slice_ends', 'topk_slice_axes'], ['last_logits']),
+            helper.make_node('TopK', ['last_logits', 'topk_k'], ['top_values', 'top_indices'], axis=-1),
+        ])
+        # 输出改为 top_values, top_indices, present.*（present 顺序不变）
+        outputs = [
+            helper.make_tensor_value_info('top_values', logits.type.tensor_type.elem_type, [1, 1, k]),
+            helper.make_tensor_value_info('top_indices', TensorProto.INT64, [1, 1, k]),
+        ] + [copy.deepcopy(o) for o in graph.output[1:]]
+        del graph.output[:]
+        graph.output.extend(outputs)
+        onnx.save(model, out_path)
+        return out_path
+    except Exception as e:
+        print(f'警告：解码器追加TopK失败（{e}），回退到完整logits')
+        return None
+
+
+def materialize_embeddings(embed_sess, vocab_size, hidden, chunk=8192):
+    # 分块跑一遍 embed_tokens 得到完整 [vocab, hidden] 嵌入表，之后取token嵌入只需一次索引
+    table = np.empty((vocab_size, hidden), dtype=np.float32)
+    for start in range(0, vocab_size, chunk):
+        ids = np.arange(start, min(start + chunk, vocab_size), dtype=np.int64)[None, :]
+        table[start:start + ids.shape[1]] = embed_sess.run(None, {'input_ids': ids})[0][0]
+    return table
+
+
+def run_decoder(dec_sess, io_binding, output_names, inputs, past):
+    # 输出顺序假设为 logits（或 top_values, top_indices）, present.0.key, present.0.value, ...
+    # past 为上一步的 present OrtValue 列表；返回 (非present输出的numpy列表, present列表)
+    io_binding.clear_binding_inputs()
+    io_binding.clear_binding_outputs()
+    for name, arr in inputs.items():
+        io_binding.bind_cpu_input(name, arr)
+    for l in range(len(past) // 2):
+        io_binding.bind_ortvalue_input(f'past_key_values.{l}.key', past[2 * l])
+        io_binding.bind_ortvalue_input(f'past_key_values.{l}.value', past[2 * l + 1])
+    for name in output_names:
+        io_binding.bind_output(name, 'cpu')
+    dec_sess.run_with_iobinding(io_binding)
+    outs = io_binding.get_outputs()
+    n_head = sum(1 for name in output_names if not name.startswith('present'))
+    return [o.numpy() for o in outs[:n_head]], outs[n_head:]
 
 
 def main():
@@ -312,6 +526,12 @@ def main():
     parser.add_argument('--top_p', type=float, default=0.95)
     parser.add_argument('--repetition_penalty', type=float, default=1.1)
     parser.add_argument('--max_new_tokens', type=int, default=96)
+    parser.add_argument('--projector', type=str, default='int8', choices=['int8', 'fp32'], help='视觉projector精度，int8需要onnx包')
+    parser.add_argument('--embed_table_max_mb', type=int, default=0,
+                        help='嵌入表不超过该大小(MB)时启动时展开为numpy数组，逐token改为查表；'
+                             '展开需对整个词表跑一次embed模型并常驻 vocab*hidden*4 字节内存，'
+                             '只在同一进程生成大量token时才划算。默认0：每步调用embed模型')
+    parser.add_argument('--sample_top_k', type=int, default=256, help='解码器图内TopK候选数，0表示返回完整logits')
     parser.add_argument('--verbose', action='store_true')
     args = parser.parse_args()
 
@@ -323,11 +543,14 @@ def main():
 
     providers = ['CPUExecutionProvider']
     so = ort.SessionOptions()
-    so.intra_op_num_threads = 2
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    so.intra_op_num_threads = os.cpu_count() or 4
 
     vision_sess = ort.InferenceSession(VISION_MODEL, so, providers=providers)
     embed_sess = ort.InferenceSession(EMBED_MODEL, so, providers=providers)
-    dec_sess = ort.InferenceSession(DECODER_MODEL, so, providers=providers)
+    topk_model = build_topk_decoder(DECODER_MODEL, args.sample_top_k) if args.sample_top_k > 0 else None
+    dec_sess = ort.InferenceSession(topk_model or DECODER_MODEL, so, providers=providers)
 
     # 构建与车机一致的分词器与模板
     tokenizer = BpeTokenizerPy(TOKENIZER_DIR)
@@ -347,14 +570,22 @@ def main():
     feat_dim = vf.shape[2]
 
     # 2) 文本嵌入
-    text_emb = embed_sess.run(None, {'input_ids': input_ids})[0].astype(np.float32)  # [1, L, hidden]
+    vocab_size = int(cfg.get('vocab_size', 0))
+    embed_table = None
+    if 0 < vocab_size * hidden * 4 <= args.embed_table_max_mb * 1024 * 1024:
+        embed_table = materialize_embeddings(embed_sess, vocab_size, hidden)
+        text_emb = embed_table[input_ids]  # [1, L, hidden]
+    else:
+        text_emb = embed_sess.run(None, {'input_ids': input_ids})[0].astype(np.float32)  # [1, L, hidden]
     L = text_emb.shape[1]
 
     # 3) Project视觉序列到hidden，并在 <image> 位置展开替换
     if feat_dim == hidden:
         vis_proj = vf.reshape(T, feat_dim)  # 已投影
     else:
-        vis_proj = project_vision(vf.reshape(T, feat_dim), hidden_expected=hidden, mm_hidden_expected=mm_hidden)
+        proj_path = build_projector_int8() if args.projector == 'int8' else None
+        proj_sess = ort.InferenceSession(proj_path, so, providers=providers) if proj_path else None
+        vis_proj = project_vision(vf.reshape(T, feat_dim), hidden_expected=hidden, mm_hidden_expected=mm_hidden, proj_sess=proj_sess)
     # 拼接：把 <image> 占位替换为 T 个视觉token，其余照抄
     image_pos_arr = np.where(input_ids[0] == image_token_id)[0]
     image_pos = int(image_pos_arr[0]) if image_pos_arr.size > 0 else None
@@ -362,20 +593,19 @@ def main():
         print('警告：未找到<image>占位，直接返回')
         return
     total_len = L - 1 + T
-    inputs_embeds = np.zeros((1, total_len, hidden), dtype=np.float32)
-    w = 0
-    for i in range(L):
-        if i == image_pos:
-            inputs_embeds[0, w:w+T, :] = vis_proj
-            w += T
-        else:
-            inputs_embeds[0, w, :] = text_emb[0, i, :]
-            w += 1
+    inputs_embeds = np.concatenate([
+        text_emb[:, :image_pos, :],
+        vis_proj.reshape(1, T, hidden),
+        text_emb[:, image_pos + 1:, :],
+    ], axis=1)
 
     # 4) 自回归生成
-    # 构造初始 mask/pos
-    attn_mask = np.ones((1, total_len), dtype=np.int64)
-    position_ids = np.arange(total_len, dtype=np.int64)[None, :]
+    # 按最大长度预分配 mask/pos，每步只取切片，解码循环内不再分配
+    max_len = total_len + args.max_new_tokens
+    attn_buf = np.ones((1, max_len), dtype=np.int64)
+    pos_buf = np.arange(max_len, dtype=np.int64)[None, :]
+    attn_mask = attn_buf[:, :total_len]
+    position_ids = pos_buf[:, :total_len]
 
     # past_key_values 为空（根据签名推断）
     inputs = { 'inputs_embeds': inputs_embeds, 'attention_mask': attn_mask, 'position_ids': position_ids }
@@ -391,10 +621,14 @@ def main():
         inputs[f'past_key_values.{l}.key'] = empty
         inputs[f'past_key_values.{l}.value'] = empty
 
-    out = dec_sess.run(None, inputs)
-    logits = out[0]  # [1, S, vocab]
-    vocab = logits.shape[-1]
-    last = logits[0, -1, :]
+    # IOBinding：present 以 OrtValue 形式直接回绑为下一步 past，不经过 numpy
+    io_binding = dec_sess.io_binding()
+    output_names = [o.name for o in dec_sess.get_outputs()]
+    logit_outs, past = run_decoder(dec_sess, io_binding, output_names, inputs, [])
+    past_len = total_len  # 空KV预填充后缓存长度即为total_len，之后每步+1
+    # 完整logits: [1, S, vocab]；图内TopK: top_values/top_indices [1, 1, k]
+    last = logit_outs[0][0, -1, :]
+    last_ids = logit_outs[1][0, -1, :] if topk_model else None
     seen = {}
     generated = []
     temperature = args.temperature
@@ -403,7 +637,7 @@ def main():
 
     # 逐步生成，单步输入
     for step in range(args.max_new_tokens):
-        nid = top_p_sample(last, top_p=top_p, temperature=temperature, repetition_penalty=rep, seen=seen)
+        nid = top_p_sample(last, top_p=top_p, temperature=temperature, repetition_penalty=rep, seen=seen, ids=last_ids)
         generated.append(nid)
         seen[nid] = seen.get(nid, 0) + 1
         if args.verbose:
@@ -415,23 +649,20 @@ def main():
         if nid == eos_id:
             break
         # 嵌入新token
-        tok_emb = embed_sess.run(None, {'input_ids': np.array([[nid]], dtype=np.int64)})[0]  # [1,1,hidden]
-        # 构造步进输入
-        # 从 out 中取 present 作为下一轮 past（假设输出顺序为 logits, present.0.key, present.0.value, ...）
-        # 计算 past_len 以构造 attention_mask 与 position_ids
-        k0 = out[1]
-        past_len = int(k0.shape[2])  # [1, heads, past_len, head_dim]
+        if embed_table is not None:
+            tok_emb = embed_table[nid][None, None, :]  # [1,1,hidden]
+        else:
+            tok_emb = embed_sess.run(None, {'input_ids': np.array([[nid]], dtype=np.int64)})[0]  # [1,1,hidden]
+        # 构造步进输入（past_len 自行累计，无需读取 present 的形状）
         feed = {
             'inputs_embeds': tok_emb,
-            'attention_mask': np.ones((1, past_len + 1), dtype=np.int64),
-            'position_ids': np.array([[past_len]], dtype=np.int64),
+            'attention_mask': attn_buf[:, :past_len + 1],
+            'position_ids': pos_buf[:, past_len:past_len + 1],
         }
-        idx = 1
-        for l in range(num_layers):
-            feed[f'past_key_values.{l}.key'] = out[idx]; feed[f'past_key_values.{l}.value'] = out[idx+1]
-            idx += 2
-        out = dec_sess.run(None, feed)
-        last = out[0][0, -1, :]
+        logit_outs, past = run_decoder(dec_sess, io_binding, output_names, feed, past)
+        past_len += 1
+        last = logit_outs[0][0, -1, :]
+        last_ids = logit_outs[1][0, -1, :] if topk_model else None
 
     # BPE解码为可读中文文本
     # 裁剪到EOS并过滤特殊token